@@ -7,19 +7,100 @@ AI-powered project management for paper publication
 import os
 import json
 import re
+import asyncio
+import threading
+import time
 import anthropic
-from flask import Flask, request, jsonify, send_from_directory
-from flask_cors import CORS
-from datetime import datetime, timedelta
+import orjson
+from quart import Quart, request, jsonify, send_from_directory
+from quart_cors import cors
+from datetime import date, datetime, timedelta
+from operator import itemgetter
 from pathlib import Path
 
-app = Flask(__name__, static_folder='static')
-CORS(app)
+try:
+    import numpy as np
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    # Semantic response cache is optional; chat works without it
+    SentenceTransformer = None
+
+app = Quart(__name__, static_folder='static')
+app = cors(app)
 
 # Data file path
 DATA_FILE = Path(__file__).parent / 'project_data.json'
 
+# Number of chat_history entries kept after older turns are summarized
+CHAT_HISTORY_LIMIT = 50
+# chat_history length that triggers summarizing older turns into data['memory']
+CHAT_HISTORY_SUMMARIZE_AT = 100
+# Hard cap on stored chat_history, applied on save even if summarizing keeps failing
+CHAT_HISTORY_MAX = 2 * CHAT_HISTORY_SUMMARIZE_AT
+# Most turns (and characters per turn) sent to the summarizer in one call
+SUMMARY_CHUNK_TURNS = 100
+SUMMARY_MESSAGE_CHARS = 2000
+# Wait after a failed summary, doubled per consecutive failure up to the max
+SUMMARY_RETRY_SECONDS = 60
+SUMMARY_RETRY_MAX_SECONDS = 3600
+
+# Scheduling order for task priorities (unknown priorities sort last)
+PRIORITY_RANKS = {'critical': 0, 'high': 1, 'medium': 2, 'low': 3}
+
+# Parsed project data, reused until the file's mtime changes, plus its task index
+_cache = {"mtime": 0, "data": None, "index": None, "project_start_dt": None, "lock": threading.Lock()}
+
+# Held across each load-modify-save so concurrent handlers don't overwrite each other's changes
+_data_lock = asyncio.Lock()
+
+# ANTHROPIC_API_KEY line in ~/.env
+ENV_API_KEY_RE = re.compile(r'^ANTHROPIC_API_KEY=(.*)$', re.MULTILINE)
+
+
+def _load_api_key():
+    """Read ANTHROPIC_API_KEY from the environment, falling back to ~/.env"""
+    api_key = os.environ.get('ANTHROPIC_API_KEY')
+    if api_key:
+        return api_key
+
+    env_file = Path.home() / '.env'
+    if env_file.exists():
+        m = ENV_API_KEY_RE.search(env_file.read_text())
+        if m:
+            return m.group(1).strip().strip('"\'')
+    return None
+
+
+# Resolved once at import; the request path never touches ~/.env
+API_KEY = _load_api_key()
+
+# Shared client so requests reuse one connection pool
+CLIENT = anthropic.AsyncAnthropic(api_key=API_KEY, max_retries=2, timeout=60.0) if API_KEY else None
+
+# Fenced task_update blocks emitted by the AI
+TASK_UPDATE_RE = re.compile(r'```task_update\s*\n?(.*?)\n?```', re.DOTALL)
+
+# Simple chat commands handled without the AI
+MOVE_INTENT_RE = re.compile(r'(?i)move\s+(.+?)\s+to\s+week\s+(\d+)\s*[.!]?$')
+COMPLETE_INTENT_RE = re.compile(r"(?i)i(?:\s+have|\s+am|['’]ve|['’]m)?\s+(?:finished|completed|done with)\s+(.+?)\s*[.!]?$")
+AUTO_ADJUST_INTENT_RE = re.compile(r'(?i)(?:please\s+)?auto[- ]?adjust(?:\s+(?:the|my)\s+schedule)?\s*[.!]?$')
+INTENT_WORD_RE = re.compile(r'[a-z0-9]+')
+INTENT_STOPWORDS = {'the', 'a', 'an', 'my', 'all', 'on', 'of', 'for', 'to', 'from', 'and', 'or', 'with', 'task'}
+
+# Semantic response cache for repeated chat questions
+SEMANTIC_CACHE_MODEL = 'all-MiniLM-L6-v2'
+SEMANTIC_CACHE_THRESHOLD = 0.85
+SEMANTIC_CACHE_SIZE = 500
+# Messages whose answer depends on the conversation so far, or that ask for a change
+SEMANTIC_CACHE_SKIP_RE = re.compile(
+    r"(?i)^\s*(?:yes|no|yeah|yep|nope|ok|okay|sure|why|and|but|so|then|also|what about)\b"
+    r"|\b(?:it|that|this|these|those|them|they|again|instead|above|previous)\b"
+    r"|\b(?:move|add|delete|remove|complete|finish|finished|done|mark|adjust|reschedule|schedule|postpone|push|shift|rename|change|update)\b"
+)
+SEMANTIC_CACHE_MIN_WORDS = 4
+
 # System prompt for the AI assistant
+# Keep this byte-stable (no interpolated values) so the prompt cache prefix hits
 SYSTEM_PROMPT = """You are a specialized research assistant helping Dr. Alen Juginovic publish a high-impact paper on "Sleep deprivation causes severe, largely irreversible myelin damage in the brain."
 
 ## Your Role
@@ -50,6 +131,8 @@ When the user asks you to adjust the schedule, move tasks, or you recommend time
 
 **YOU MUST USE THE EXACT TASK IDs PROVIDED IN THE CURRENT TASKS LIST.**
 
+The current tasks list is a JSON array; each task has "id", "title", "week", "done" (true once completed), "fig" (figure number or null) and "prio" (critical/high/medium/low).
+
 For EACH task change, output a JSON block in this EXACT format:
 
 ```task_update
@@ -87,19 +170,501 @@ Example - if user says "I finished the Olig2 staining":
 """
 
 
-def load_project_data():
-    """Load project data from JSON file"""
-    if DATA_FILE.exists():
-        with open(DATA_FILE, 'r') as f:
-            return json.load(f)
-    return get_default_data()
+def load_project_data(copy=False):
+    """Load project data, reusing the parsed copy while the file is unchanged.
+
+    The cached dict is shared and must not be modified. Handlers that change the
+    data pass copy=True and save their private copy, which only then replaces
+    the cached one, so a request that fails halfway leaves nothing behind.
+    """
+    with _cache['lock']:
+        try:
+            mtime = DATA_FILE.stat().st_mtime_ns
+        except FileNotFoundError:
+            return get_default_data()
+
+        if _cache['data'] is None or _cache['mtime'] != mtime:
+            _cache['data'] = orjson.loads(DATA_FILE.read_bytes())
+            _cache['index'] = build_task_index(_cache['data'])
+            _cache['project_start_dt'] = date.fromisoformat(_cache['data']['project_start'])
+            _cache['mtime'] = mtime
+        data = _cache['data']
+
+    if copy:
+        return orjson.loads(orjson.dumps(data))
+    return data
+
+
+def save_project_data(data, index=None):
+    """Atomically save project data to JSON file
+
+    Handlers that edited data through its task index pass that index, which is then
+    cached as-is; otherwise the index is rebuilt here.
+    """
+    if len(data.get('chat_history', [])) > CHAT_HISTORY_MAX:
+        data['chat_history'] = data['chat_history'][-CHAT_HISTORY_MAX:]
+
+    # Validate and index before touching the file, so bad data can never be written
+    project_start_dt = validate_project_data(data)
+    if index is None:
+        index = build_task_index(data)
+    else:
+        index['tasks_version'] = data.get('tasks_version', 0)
+
+    with _cache['lock']:
+        DATA_FILE.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = DATA_FILE.with_suffix('.json.tmp')
+        tmp_file.write_bytes(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+        os.replace(tmp_file, DATA_FILE)
+        _cache['data'] = data
+        _cache['index'] = index
+        _cache['project_start_dt'] = project_start_dt
+        _cache['mtime'] = DATA_FILE.stat().st_mtime_ns
+
+
+def validate_project_data(data):
+    """Check the fields the server relies on; returns the parsed project start date.
+
+    Raises ValueError describing the first problem found.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("project data must be an object")
+    try:
+        project_start_dt = date.fromisoformat(data.get('project_start', ''))
+    except (TypeError, ValueError):
+        raise ValueError("project_start must be a YYYY-MM-DD date")
+    tasks = data.get('tasks')
+    if not isinstance(tasks, list) or not all(isinstance(t, dict) and isinstance(t.get('id'), str) for t in tasks):
+        raise ValueError("tasks must be a list of objects with a string id")
+    return project_start_dt
+
+
+def get_project_start(data):
+    """Return project_start as a date, reusing the cached parse when data is the cached dict"""
+    if data is _cache['data'] and _cache['project_start_dt'] is not None:
+        return _cache['project_start_dt']
+    return date.fromisoformat(data['project_start'])
+
+
+def _current_week(data):
+    """Current project week (1-8), counted from project_start"""
+    return max(1, min(8, ((date.today() - get_project_start(data)).days // 7) + 1))
+
+
+def build_task_index(data):
+    """Index tasks by id, with parallel per-task arrays for bulk scheduling"""
+    tasks = data['tasks']
+    return {
+        "tasks_version": data.get('tasks_version', 0),
+        "tasks_by_id": {t['id']: t for t in tasks},
+        "positions": {t['id']: i for i, t in enumerate(tasks)},
+        "weeks": [t.get('week', 1) for t in tasks],
+        "completed": [bool(t.get('completed')) for t in tasks],
+        "priority_ranks": [PRIORITY_RANKS.get(t.get('priority'), 3) for t in tasks],
+    }
+
+
+def get_task_index(data):
+    """Return the task index for data, reusing the cached one when data is the cached dict"""
+    index = _cache['index']
+    if data is _cache['data'] and index is not None and index['tasks_version'] == data.get('tasks_version', 0):
+        return index
+    return build_task_index(data)
+
+
+def refresh_task_index(index, task):
+    """Update the per-task arrays after a task's fields changed in place"""
+    i = index['positions'][task['id']]
+    index['weeks'][i] = task.get('week', 1)
+    index['completed'][i] = bool(task.get('completed'))
+    index['priority_ranks'][i] = PRIORITY_RANKS.get(task.get('priority'), 3)
+
+
+def bump_tasks_version(data):
+    """Mark tasks/figures as changed so the cached project state is rebuilt"""
+    data['tasks_version'] = data.get('tasks_version', 0) + 1
+
+
+# Last rendered project state block, reused while tasks_version and week are unchanged
+_project_state = {"key": None, "text": None}
+
+
+def build_project_state(data, current_week):
+    """Render the task list and figure status block sent to the AI"""
+    key = (data.get('tasks_version', 0), current_week)
+    if _project_state['key'] == key:
+        return _project_state['text']
+
+    # Compact JSON task list with IDs for the AI
+    tasks = data['tasks']
+    task_list_str = orjson.dumps([
+        {"id": t['id'], "title": t.get('title', ''), "week": t.get('week'), "done": bool(t.get('completed')), "fig": t.get('figure'), "prio": t.get('priority')}
+        for t in tasks
+    ]).decode()
+
+    completed_count = sum(get_task_index(data)['completed'])
+    pending_count = len(tasks) - completed_count
+
+    text = f"""
+## Current Project State (Week {current_week} of 8)
+
+**Progress:** {completed_count} completed, {pending_count} pending
+
+**CURRENT TASKS LIST (use these exact IDs for any adjustments):**
+{task_list_str}
+
+**Figure status:**
+{chr(10).join([f"- Figure {f['id']} ({f['title']}): {f['status']}" for f in data['figures']])}
+
+---
+"""
+    _project_state['key'] = key
+    _project_state['text'] = text
+    return text
+
+
+# Cached (user_message, response, tasks_version) entries, oldest first, with a row per entry in vectors
+_semantic_cache = {"model": None, "disabled": False, "entries": [], "vectors": None, "lock": threading.Lock()}
+
+
+def _embed_message(text):
+    """Embed a chat message as a unit vector, or None if embeddings are unavailable
+
+    The model is loaded once, on first use. If loading or encoding fails (e.g. the
+    model can't be downloaded), the cache is disabled and chat carries on without it.
+    """
+    if SentenceTransformer is None or _semantic_cache['disabled']:
+        return None
+    try:
+        with _semantic_cache['lock']:
+            if _semantic_cache['disabled']:
+                return None
+            if _semantic_cache['model'] is None:
+                _semantic_cache['model'] = SentenceTransformer(SEMANTIC_CACHE_MODEL)
+        return _semantic_cache['model'].encode(text, normalize_embeddings=True)
+    except Exception as e:
+        _semantic_cache['disabled'] = True
+        print(f"Semantic cache disabled, embedding failed: {e}")
+        return None
+
+
+def semantic_cache_eligible(user_message):
+    """Whether a message is a standalone question whose answer may be reused"""
+    return (len(user_message.split()) >= SEMANTIC_CACHE_MIN_WORDS
+            and not SEMANTIC_CACHE_SKIP_RE.search(user_message))
+
+
+def semantic_cache_lookup(vec, tasks_version, current_week, context):
+    """Return a cached response for a near-identical question, if the tasks, week and chat memory haven't changed"""
+    entries = _semantic_cache['entries']
+    if vec is None or not entries:
+        return None
+
+    scores = _semantic_cache['vectors'] @ vec
+    for i in np.argsort(scores)[::-1]:
+        if scores[i] < SEMANTIC_CACHE_THRESHOLD:
+            break
+        entry = entries[i]
+        if (entry['tasks_version'], entry['current_week'], entry['context']) == (tasks_version, current_week, context):
+            # Move to the end so it is evicted last
+            entries.append(entries.pop(i))
+            vectors = _semantic_cache['vectors']
+            _semantic_cache['vectors'] = np.vstack([np.delete(vectors, i, axis=0), vectors[i]])
+            return entry['response']
+    return None
+
+
+def semantic_cache_store(vec, user_message, response, tasks_version, current_week, context):
+    """Remember a response, evicting the least recently used entry when full"""
+    if vec is None:
+        return
+
+    entries = _semantic_cache['entries']
+    vectors = _semantic_cache['vectors']
+    entries.append({"user_message": user_message, "response": response, "tasks_version": tasks_version, "current_week": current_week, "context": context})
+    vectors = vec[None, :] if vectors is None else np.vstack([vectors, vec])
+
+    if len(entries) > SEMANTIC_CACHE_SIZE:
+        del entries[0]
+        vectors = vectors[1:]
+    _semantic_cache['vectors'] = vectors
+
+
+def build_system(project_state, memory=None):
+    """System blocks: SYSTEM_PROMPT + project state as one cached prefix, then the chat summary if any"""
+    # Ahead of the sliding chat history, the prefix only changes when tasks do, and the
+    # two blocks together clear the minimum cacheable prompt length
+    system = [
+        {"type": "text", "text": SYSTEM_PROMPT},
+        {"type": "text", "text": project_state, "cache_control": {"type": "ephemeral"}},
+    ]
+    if memory:
+        system.append({"type": "text", "text": f"## Summary of earlier conversation\n{memory}"})
+    return system
+
+
+# Strong references to fire-and-forget tasks so they aren't garbage collected mid-run
+_background_tasks = set()
+
+
+def spawn(coro):
+    """Run coro as a background task that outlives the request that started it"""
+    task = asyncio.ensure_future(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_task_done)
+    return task
+
+
+def _background_task_done(task):
+    _background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        print(f"Background task failed: {task.exception()}")
+
+
+# Chat replies in flight, keyed by their system + messages payload
+_inflight = {}
+
+
+def join_reply(system, messages, start):
+    """Return (task, started): the in-flight reply task for this exact prompt, or a new one from start().
+
+    The task covers both the Claude call and finish(), so identical concurrent chats share
+    one API call, apply and save its task updates once, and all get the same payload.
+    """
+    key = orjson.dumps([system, messages])
+    task = _inflight.get(key)
+    if task is not None:
+        return task, False
+    task = spawn(start())
+    _inflight[key] = task
+    task.add_done_callback(lambda _: _inflight.pop(key, None))
+    return task, True
+
+
+# The running summarize_chat_history() task (only one at a time) and its failure backoff
+_summary = {"task": None, "failures": 0, "retry_at": 0.0}
+
+
+def schedule_summary(data):
+    """Start summarizing chat history in the background once it gets long"""
+    if len(data.get('chat_history', [])) <= CHAT_HISTORY_SUMMARIZE_AT or CLIENT is None:
+        return
+    if _summary['task'] is not None and not _summary['task'].done():
+        return
+    if time.monotonic() < _summary['retry_at']:
+        return
+    _summary['task'] = spawn(summarize_chat_history())
+
+
+async def summarize_chat_history():
+    """Fold the oldest chat turns beyond CHAT_HISTORY_LIMIT into data['memory']
+
+    Turns are only dropped after the summary succeeds, so a failed call leaves the
+    history intact for a later attempt (save_project_data still caps it at
+    CHAT_HISTORY_MAX). At most SUMMARY_CHUNK_TURNS are summarized per call.
+    """
+    data = await asyncio.to_thread(load_project_data)
+    history = data['chat_history']
+    older = history[:min(len(history) - CHAT_HISTORY_LIMIT, SUMMARY_CHUNK_TURNS)]
+    transcript = "\n\n".join(f"{msg['role']}: {str(msg['content'])[:SUMMARY_MESSAGE_CHARS]}" for msg in older)
+    previous = data.get('memory')
+    if previous:
+        transcript = f"Previous summary:\n{previous}\n\n{transcript}"
+
+    try:
+        response = await CLIENT.messages.create(
+            model="claude-3-5-haiku-20241022",
+            max_tokens=500,
+            system="Summarize this research-planning conversation in a few short bullet points. Keep decisions, results reported, and schedule changes; drop small talk.",
+            messages=[{"role": "user", "content": transcript}]
+        )
+    except Exception as e:
+        _summary['failures'] += 1
+        delay = min(SUMMARY_RETRY_SECONDS * 2 ** (_summary['failures'] - 1), SUMMARY_RETRY_MAX_SECONDS)
+        _summary['retry_at'] = time.monotonic() + delay
+        print(f"Failed to summarize chat history (retrying in {delay}s): {e}")
+        return
+    _summary['failures'] = 0
+    _summary['retry_at'] = 0.0
+
+    # Other chats may have saved meanwhile; drop only the turns that went into the summary
+    async with _data_lock:
+        data = await asyncio.to_thread(load_project_data, True)
+        if data['chat_history'][:len(older)] != older or data.get('memory') != previous:
+            print("Chat history changed while summarizing, skipping")
+            return
+        data['memory'] = response.content[0].text
+        data['chat_history'] = data['chat_history'][len(older):]
+        await asyncio.to_thread(save_project_data, data)
+
+
+def apply_task_update(data, index, update, current_week):
+    """Apply one task_update action to data['tasks'], keeping the task index in sync"""
+    task_index = index['tasks_by_id']
+    action = update.get('action', '')
+
+    if action == 'move':
+        task_id = update.get('task_id')
+        new_week = update.get('new_week')
+        task = task_index.get(task_id)
+        if task and new_week:
+            task['week'] = int(new_week)
+            refresh_task_index(index, task)
+            print(f"Moved task {task_id} to week {new_week}")
+
+    elif action == 'complete':
+        task_id = update.get('task_id')
+        task = task_index.get(task_id)
+        if task:
+            task['completed'] = True
+            refresh_task_index(index, task)
+            print(f"Completed task {task_id}")
+
+    elif action == 'add':
+        new_id = 'task-' + str(int(datetime.now().timestamp()))
+        new_task = {
+            'id': new_id,
+            'title': update.get('title', 'New Task'),
+            'week': int(update.get('week', current_week)),
+            'completed': False,
+            'priority': update.get('priority', 'medium'),
+            'figure': update.get('figure'),
+            'notes': update.get('reason', '')
+        }
+        data['tasks'].append(new_task)
+        task_index[new_id] = new_task
+        index['positions'][new_id] = len(data['tasks']) - 1
+        index['weeks'].append(new_task['week'])
+        index['completed'].append(False)
+        index['priority_ranks'].append(PRIORITY_RANKS.get(new_task['priority'], 3))
+        print(f"Added new task: {new_task['title']}")
+
+    elif action == 'delete':
+        task_id = update.get('task_id')
+        if task_id in task_index:
+            data['tasks'] = [t for t in data['tasks'] if t['id'] != task_id]
+            # Positions shift after a delete, so rebuild the index
+            index.update(build_task_index(data))
+            print(f"Deleted task {task_id}")
+
+
+def adjust_schedule(data, index, current_week):
+    """Move overdue tasks to the current week and spread the rest over the remaining weeks"""
+    tasks = data['tasks']
+    weeks, completed, ranks = index['weeks'], index['completed'], index['priority_ranks']
+
+    # Move incomplete tasks scheduled before current week to current week
+    for i in range(len(tasks)):
+        if not completed[i] and weeks[i] < current_week:
+            weeks[i] = tasks[i]['week'] = current_week
+
+    # Redistribute remaining tasks
+    incomplete = [i for i in range(len(tasks)) if not completed[i] and weeks[i] >= current_week]
+    weeks_remaining = 8 - current_week + 1
+
+    if weeks_remaining > 0 and len(incomplete) > 0:
+        # Sort by week, then priority, on keys built once up front
+        keyed = [((weeks[i], ranks[i]), i) for i in incomplete]
+        keyed.sort(key=itemgetter(0))
+        incomplete = [i for _, i in keyed]
+
+        # Spread across remaining weeks
+        tasks_per_week = max(3, len(incomplete) // weeks_remaining)
+        week = current_week
+        count = 0
 
+        for i in incomplete:
+            if count >= tasks_per_week and week < 8:
+                week += 1
+                count = 0
+            weeks[i] = tasks[i]['week'] = week
+            count += 1
 
-def save_project_data(data):
-    """Save project data to JSON file"""
-    DATA_FILE.parent.mkdir(parents=True, exist_ok=True)
-    with open(DATA_FILE, 'w') as f:
-        json.dump(data, f, indent=2)
+
+def find_task(data, phrase, include_completed=True):
+    """Match a loosely worded task name to a single task, or None if it is unclear"""
+    words = [w for w in INTENT_WORD_RE.findall(phrase.lower()) if w not in INTENT_STOPWORDS]
+    if not words:
+        return None
+
+    best, best_tasks = 0, []
+    for t in data['tasks']:
+        if t.get('completed') and not include_completed:
+            continue
+        title_words = INTENT_WORD_RE.findall(t.get('title', '').lower())
+        if t['id'] == phrase.strip().lower() or [w for w in title_words if w not in INTENT_STOPWORDS] == words:
+            return t
+        # Words match when equal or sharing a 4+ letter stem ("quantification" ~ "quantify")
+        score = sum(any(w == tw or len(os.path.commonprefix([w, tw])) >= 4 for tw in title_words) for w in words)
+        if score > best:
+            best, best_tasks = score, [t]
+        elif score == best:
+            best_tasks.append(t)
+
+    # Short of an exact id/title, every word must match, there must be at least two of
+    # them (one vague word like "writing" fits several tasks), and only one task may match
+    if best == len(words) and best >= 2 and len(best_tasks) == 1:
+        return best_tasks[0]
+    return None
+
+
+def match_intent(data, user_message):
+    """Recognize a simple schedule command without the AI; returns an intent tuple or None
+
+    Only reads data, so it can run on the shared snapshot; apply_intent() makes the change.
+    """
+    message = user_message.strip()
+
+    m = MOVE_INTENT_RE.match(message)
+    if m:
+        task = find_task(data, m.group(1))
+        # Unknown tasks and weeks outside the 8-week plan go to the AI
+        if task is None or not 1 <= int(m.group(2)) <= 8:
+            return None
+        return ('move', task['id'], int(m.group(2)))
+
+    m = COMPLETE_INTENT_RE.match(message)
+    if m:
+        task = find_task(data, m.group(1), include_completed=False)
+        if task is None:
+            return None
+        return ('complete', task['id'])
+
+    if AUTO_ADJUST_INTENT_RE.match(message):
+        return ('auto-adjust',)
+
+    return None
+
+
+def apply_intent(data, index, intent, current_week):
+    """Apply a matched intent to data; returns (reply, task_updates), or None if it no longer applies"""
+    action = intent[0]
+
+    if action == 'move':
+        task = index['tasks_by_id'].get(intent[1])
+        if task is None:
+            return None
+        update = {"action": "move", "task_id": task['id'], "new_week": intent[2], "reason": "User requested"}
+        apply_task_update(data, index, update, current_week)
+        return f"Moved **{task['title']}** to week {update['new_week']}.", [update]
+
+    if action == 'complete':
+        task = index['tasks_by_id'].get(intent[1])
+        if task is None or task.get('completed'):
+            return None
+        update = {"action": "complete", "task_id": task['id'], "reason": "User completed"}
+        apply_task_update(data, index, update, current_week)
+        return f"Marked **{task['title']}** as complete.", [update]
+
+    weeks_before = {t['id']: t.get('week') for t in data['tasks']}
+    adjust_schedule(data, index, current_week)
+    updates = [
+        {"action": "move", "task_id": t['id'], "new_week": t['week'], "reason": "Auto-adjust"}
+        for t in data['tasks'] if t.get('week') != weeks_before[t['id']]
+    ]
+    if not updates:
+        return "The schedule is already balanced, nothing to move.", []
+    return f"Auto-adjusted the schedule from week {current_week}: moved {len(updates)} task(s).", updates
 
 
 def get_default_data():
@@ -139,130 +704,138 @@ def get_default_data():
             {"id": 4, "title": "Recovery Failure", "status": "partial"}
         ],
         "results": [],
-        "chat_history": []
+        "chat_history": [],
+        "tasks_version": 0
     }
 
 
+def orjson_response(obj):
+    """jsonify() replacement that serializes with orjson"""
+    return app.response_class(orjson.dumps(obj), mimetype='application/json')
+
+
 @app.route('/')
-def index():
-    return send_from_directory('static', 'index.html')
+async def index():
+    return await send_from_directory('static', 'index.html')
 
 
 @app.route('/api/data', methods=['GET'])
-def get_data():
+async def get_data():
     """Get current project data"""
-    return jsonify(load_project_data())
+    # Writes are atomic renames, so the file on disk is always complete: serve it as-is
+    if DATA_FILE.exists():
+        return await send_from_directory(DATA_FILE.parent, DATA_FILE.name, mimetype='application/json', cache_timeout=0)
+    return orjson_response(get_default_data())
 
 
 @app.route('/api/data', methods=['POST'])
-def save_data_endpoint():
+async def save_data_endpoint():
     """Save project data"""
-    data = request.json
-    save_project_data(data)
+    data = await request.get_json()
+    try:
+        validate_project_data(data)
+    except ValueError as e:
+        return jsonify({"status": "invalid", "error": str(e)}), 400
+
+    async with _data_lock:
+        # Continue from the stored version so a client-supplied one can't reuse a stale cache key
+        stored = await asyncio.to_thread(load_project_data)
+        data['tasks_version'] = stored.get('tasks_version', 0)
+        bump_tasks_version(data)
+        await asyncio.to_thread(save_project_data, data)
     return jsonify({"status": "saved"})
 
 
 @app.route('/api/task/<task_id>', methods=['PATCH'])
-def update_task(task_id):
+async def update_task(task_id):
     """Update a specific task"""
-    data = load_project_data()
-    updates = request.json
-
-    for task in data['tasks']:
+    updates = await request.get_json()
+
+    async with _data_lock:
+        data = await asyncio.to_thread(load_project_data, True)
+        index = get_task_index(data)
+        task = index['tasks_by_id'].get(task_id)
+        if task is None:
+            return jsonify({"status": "not_found", "task": None}), 404
+        task.update(updates)
         if task['id'] == task_id:
-            task.update(updates)
-            break
+            refresh_task_index(index, task)
+        else:
+            index.update(build_task_index(data))
 
-    save_project_data(data)
+        bump_tasks_version(data)
+        await asyncio.to_thread(save_project_data, data, index)
     return jsonify({"status": "updated", "task": task})
 
 
 @app.route('/api/auto-adjust', methods=['POST'])
-def auto_adjust():
+async def auto_adjust():
     """Automatically adjust task schedule based on current progress"""
-    data = load_project_data()
-    today = datetime.now()
-    project_start = datetime.strptime(data['project_start'], '%Y-%m-%d')
+    async with _data_lock:
+        data = await asyncio.to_thread(load_project_data, True)
+        current_week = _current_week(data)
 
-    # Calculate current week
-    days_passed = (today - project_start).days
-    current_week = max(1, min(8, (days_passed // 7) + 1))
+        index = get_task_index(data)
+        adjust_schedule(data, index, current_week)
 
-    # Get incomplete tasks that are scheduled before current week
-    overdue = [t for t in data['tasks'] if not t['completed'] and t['week'] < current_week]
-
-    # Move overdue tasks to current week
-    for task in overdue:
-        task['week'] = current_week
-
-    # Redistribute remaining tasks
-    incomplete = [t for t in data['tasks'] if not t['completed'] and t['week'] >= current_week]
-    weeks_remaining = 8 - current_week + 1
-
-    if weeks_remaining > 0 and len(incomplete) > 0:
-        # Sort by priority
-        priority_order = {'critical': 0, 'high': 1, 'medium': 2, 'low': 3}
-        incomplete.sort(key=lambda t: (t['week'], priority_order.get(t['priority'], 3)))
-
-        # Spread across remaining weeks
-        tasks_per_week = max(3, len(incomplete) // weeks_remaining)
-        week = current_week
-        count = 0
-
-        for task in incomplete:
-            for t in data['tasks']:
-                if t['id'] == task['id']:
-                    if count >= tasks_per_week and week < 8:
-                        week += 1
-                        count = 0
-                    t['week'] = week
-                    count += 1
-                    break
-
-    save_project_data(data)
+        bump_tasks_version(data)
+        await asyncio.to_thread(save_project_data, data, index)
     return jsonify({"status": "adjusted", "current_week": current_week, "data": data})
 
 
 @app.route('/api/chat', methods=['POST'])
-def chat():
+async def chat():
     """Chat with the AI research assistant"""
-    user_message = request.json.get('message', '')
-    data = load_project_data()
-
-    # Build detailed task list with IDs for the AI
-    task_list = []
-    for t in data['tasks']:
-        status = "DONE" if t['completed'] else f"Week {t['week']}"
-        fig = f" (Fig {t['figure']})" if t.get('figure') else ""
-        task_list.append(f"  - id=\"{t['id']}\" | {t['title']}{fig} | {status} | {t['priority']}")
-
-    task_list_str = "\n".join(task_list)
-
-    # Build context about current project state
-    completed_count = len([t for t in data['tasks'] if t['completed']])
-    pending_count = len([t for t in data['tasks'] if not t['completed']])
-
-    # Calculate current week
-    today = datetime.now()
-    project_start = datetime.strptime(data['project_start'], '%Y-%m-%d')
-    current_week = max(1, min(8, ((today - project_start).days // 7) + 1))
-
-    context = f"""
-## Current Project State (Week {current_week} of 8)
-
-**Progress:** {completed_count} completed, {pending_count} pending
-
-**CURRENT TASKS LIST (use these exact IDs for any adjustments):**
-{task_list_str}
-
-**Figure status:**
-{chr(10).join([f"- Figure {f['id']} ({f['title']}): {f['status']}" for f in data['figures']])}
+    user_message = (await request.get_json()).get('message', '')
+    # Read-only snapshot for building the prompt; changes are made on fresh copies below
+    data = await asyncio.to_thread(load_project_data)
+    current_week = _current_week(data)
+
+    # Simple move/complete/auto-adjust commands don't need the AI. Match on the shared
+    # snapshot and only lock and copy the data when one did.
+    intent = match_intent(data, user_message)
+    if intent is not None:
+        async with _data_lock:
+            edited = await asyncio.to_thread(load_project_data, True)
+            index = get_task_index(edited)
+            result = apply_intent(edited, index, intent, current_week)
+            if result is not None:
+                reply, task_updates = result
+                edited['chat_history'].append({"role": "user", "content": user_message, "timestamp": datetime.now().isoformat()})
+                edited['chat_history'].append({"role": "assistant", "content": reply, "timestamp": datetime.now().isoformat()})
+                if task_updates:
+                    bump_tasks_version(edited)
+                await asyncio.to_thread(save_project_data, edited, index)
+        if result is not None:
+            schedule_summary(edited)
+            return jsonify({
+                "response": reply,
+                "task_updates": task_updates,
+                "error": False
+            })
 
----
-**User message:** {user_message}
+    # Answer repeated standalone questions from the semantic cache while the tasks, the
+    # project week and the chat memory are unchanged
+    tasks_version = data.get('tasks_version', 0)
+    cache_context = data.get('memory') or ''
+    query_vec = None
+    if semantic_cache_eligible(user_message):
+        query_vec = await asyncio.to_thread(_embed_message, user_message)
+    cached_response = semantic_cache_lookup(query_vec, tasks_version, current_week, cache_context)
+    if cached_response is not None:
+        async with _data_lock:
+            edited = await asyncio.to_thread(load_project_data, True)
+            edited['chat_history'].append({"role": "user", "content": user_message, "timestamp": datetime.now().isoformat()})
+            edited['chat_history'].append({"role": "assistant", "content": cached_response, "timestamp": datetime.now().isoformat(), "cached": True})
+            await asyncio.to_thread(save_project_data, edited)
+        schedule_summary(edited)
+        return jsonify({
+            "response": cached_response,
+            "task_updates": [],
+            "error": False
+        })
 
-REMEMBER: If the user asks you to adjust, move, or modify tasks, you MUST output ```task_update blocks with the exact task IDs from the list above. The system will automatically apply your changes.
-"""
+    project_state = build_project_state(data, current_week)
 
     # Get chat history (last 6 messages for context)
     chat_history = data.get('chat_history', [])[-6:]
@@ -271,136 +844,159 @@ REMEMBER: If the user asks you to adjust, move, or modify tasks, you MUST output
     messages = []
     for msg in chat_history:
         messages.append({"role": msg['role'], "content": msg['content']})
-    messages.append({"role": "user", "content": context})
 
-    try:
-        # Load API key from environment
-        api_key = os.environ.get('ANTHROPIC_API_KEY')
-        if not api_key:
-            # Try loading from ~/.env
-            env_file = Path.home() / '.env'
-            if env_file.exists():
-                with open(env_file) as f:
-                    for line in f:
-                        if line.startswith('ANTHROPIC_API_KEY='):
-                            api_key = line.strip().split('=', 1)[1].strip('"\'')
-                            break
-
-        if not api_key:
-            return jsonify({
-                "response": "API key not found. Please set ANTHROPIC_API_KEY in your ~/.env file.",
-                "error": True,
-                "task_updates": []
-            })
+    messages.append({"role": "user", "content": f"""**User message:** {user_message}
 
-        client = anthropic.Anthropic(api_key=api_key)
+REMEMBER: If the user asks you to adjust, move, or modify tasks, you MUST output ```task_update blocks with the exact task IDs from the current tasks list. The system will automatically apply your changes.
+"""})
 
-        response = client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=2000,
-            system=SYSTEM_PROMPT,
-            messages=messages
-        )
+    # Project state is stable between task edits, so it is cached along with SYSTEM_PROMPT
+    system = build_system(project_state, data.get('memory'))
 
-        assistant_message = response.content[0].text
+    if CLIENT is None:
+        return jsonify({
+            "response": "API key not found. Please set ANTHROPIC_API_KEY in your ~/.env file.",
+            "error": True,
+            "task_updates": []
+        })
 
-        # Save to chat history (save original user message, not the context-enriched one)
-        data['chat_history'].append({"role": "user", "content": user_message, "timestamp": datetime.now().isoformat()})
-        data['chat_history'].append({"role": "assistant", "content": assistant_message, "timestamp": datetime.now().isoformat()})
-
-        # Parse task updates from response
-        task_updates = []
-
-        # Find all task_update blocks
-        pattern = r'```task_update\s*\n?(.*?)\n?```'
-        matches = re.findall(pattern, assistant_message, re.DOTALL)
-
-        for match in matches:
-            try:
-                update = json.loads(match.strip())
-                task_updates.append(update)
-
-                # Apply the update
-                action = update.get('action', '')
-
-                if action == 'move':
-                    task_id = update.get('task_id')
-                    new_week = update.get('new_week')
-                    if task_id and new_week:
-                        for task in data['tasks']:
-                            if task['id'] == task_id:
-                                task['week'] = int(new_week)
-                                print(f"Moved task {task_id} to week {new_week}")
-                                break
-
-                elif action == 'complete':
-                    task_id = update.get('task_id')
-                    if task_id:
-                        for task in data['tasks']:
-                            if task['id'] == task_id:
-                                task['completed'] = True
-                                print(f"Completed task {task_id}")
-                                break
-
-                elif action == 'add':
-                    new_id = 'task-' + str(int(datetime.now().timestamp()))
-                    new_task = {
-                        'id': new_id,
-                        'title': update.get('title', 'New Task'),
-                        'week': int(update.get('week', current_week)),
-                        'completed': False,
-                        'priority': update.get('priority', 'medium'),
-                        'figure': update.get('figure'),
-                        'notes': update.get('reason', '')
-                    }
-                    data['tasks'].append(new_task)
-                    print(f"Added new task: {new_task['title']}")
-
-                elif action == 'delete':
-                    task_id = update.get('task_id')
-                    if task_id:
-                        data['tasks'] = [t for t in data['tasks'] if t['id'] != task_id]
-                        print(f"Deleted task {task_id}")
-
-            except json.JSONDecodeError as e:
-                print(f"Failed to parse task update: {match} - {e}")
-                continue
-
-        # Save updated data
-        save_project_data(data)
-
-        # Clean the response for display (remove task_update blocks)
-        clean_response = re.sub(r'```task_update\s*\n?.*?\n?```', '', assistant_message, flags=re.DOTALL)
-        clean_response = clean_response.strip()
+    async def finish(response):
+        """Record the reply, apply its task updates and return the JSON payload for the client"""
+        assistant_message = response.content[0].text
 
-        return jsonify({
+        # Prompt cache hit/miss stats for the system prefix
+        usage = {
+            "cache_read_input_tokens": getattr(response.usage, 'cache_read_input_tokens', None) or 0,
+            "cache_creation_input_tokens": getattr(response.usage, 'cache_creation_input_tokens', None) or 0,
+            "input_tokens": response.usage.input_tokens,
+        }
+
+        # Apply to the latest saved data: other requests may have saved while Claude was answering
+        async with _data_lock:
+            data = await asyncio.to_thread(load_project_data, True)
+            index = get_task_index(data)
+
+            # Save to chat history (save original user message, not the context-enriched one)
+            data['chat_history'].append({"role": "user", "content": user_message, "timestamp": datetime.now().isoformat()})
+            data['chat_history'].append({"role": "assistant", "content": assistant_message, "timestamp": datetime.now().isoformat(), "usage": usage})
+
+            # Parse task updates from response, keeping the text between blocks for display
+            task_updates = []
+            response_parts = []
+            prev_end = 0
+
+            for m in TASK_UPDATE_RE.finditer(assistant_message):
+                response_parts.append(assistant_message[prev_end:m.start()])
+                prev_end = m.end()
+                match = m.group(1)
+                try:
+                    update = json.loads(match.strip())
+                    task_updates.append(update)
+                    apply_task_update(data, index, update, current_week)
+
+                except json.JSONDecodeError as e:
+                    print(f"Failed to parse task update: {match} - {e}")
+                    continue
+
+            response_parts.append(assistant_message[prev_end:])
+
+            if task_updates:
+                bump_tasks_version(data)
+
+            # Save updated data, caching the index kept in sync by apply_task_update
+            await asyncio.to_thread(save_project_data, data, index)
+        schedule_summary(data)
+
+        # Clean the response for display (task_update blocks removed)
+        clean_response = ''.join(response_parts).strip()
+
+        # Responses that changed tasks bump tasks_version, so they could never be served again
+        if not task_updates:
+            semantic_cache_store(query_vec, user_message, clean_response, tasks_version, current_week, cache_context)
+
+        return {
             "response": clean_response,
             "task_updates": task_updates,
             "error": False
-        })
+        }
 
-    except Exception as e:
+    def error_payload(e):
         import traceback
         traceback.print_exc()
-        return jsonify({
+        return {
             "response": f"Error communicating with AI: {str(e)}",
             "error": True,
             "task_updates": []
-        })
+        }
+
+    async def create_reply():
+        """Get the whole reply in one call, then finish the turn"""
+        return await finish(await CLIENT.messages.create(
+            model="claude-sonnet-4-20250514",
+            max_tokens=2000,
+            system=system,
+            messages=messages
+        ))
+
+    if 'text/event-stream' not in request.headers.get('Accept', ''):
+        reply, _ = join_reply(system, messages, create_reply)
+        try:
+            # Shield so one client disconnecting doesn't cancel the reply for the others
+            return jsonify(await asyncio.shield(reply))
+        except Exception as e:
+            return jsonify(error_payload(e))
+
+    async def stream_reply(deltas):
+        """Stream the reply into deltas (None marks the end), then finish the turn"""
+        try:
+            async with CLIENT.messages.stream(
+                model="claude-sonnet-4-20250514",
+                max_tokens=2000,
+                system=system,
+                messages=messages
+            ) as s:
+                async for text in s.text_stream:
+                    deltas.put_nowait(text)
+                response = await s.get_final_message()
+        finally:
+            deltas.put_nowait(None)
+        return await finish(response)
+
+    # Runs as its own task, so the turn is finished and saved even if the client disconnects.
+    # A request joining an identical reply already in flight gets only the final event.
+    deltas = asyncio.Queue()
+    reply, started = join_reply(system, messages, lambda: stream_reply(deltas))
+    if not started:
+        deltas.put_nowait(None)
+
+    async def stream():
+        """Forward text deltas as they arrive, then a final event with the cleaned reply and task updates"""
+        while (text := await deltas.get()) is not None:
+            yield f"data: {orjson.dumps({'delta': text}).decode()}\n\n"
+        try:
+            payload = await asyncio.shield(reply)
+        except Exception as e:
+            payload = error_payload(e)
+        yield f"data: {orjson.dumps(payload).decode()}\n\n"
+
+    sse = app.response_class(stream(), mimetype='text/event-stream', headers={"Cache-Control": "no-cache"})
+    sse.timeout = None
+    return sse
 
 
 @app.route('/api/result', methods=['POST'])
-def log_result():
+async def log_result():
     """Log an experimental result"""
-    data = load_project_data()
-    result = request.json
+    result = await request.get_json()
     result['date'] = datetime.now().isoformat()
 
-    if 'results' not in data:
-        data['results'] = []
-    data['results'].append(result)
+    async with _data_lock:
+        data = await asyncio.to_thread(load_project_data, True)
+        if 'results' not in data:
+            data['results'] = []
+        data['results'].append(result)
 
-    save_project_data(data)
+        await asyncio.to_thread(save_project_data, data)
     return jsonify({"status": "logged", "result": result})
 
 